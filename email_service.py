@@ -1,399 +1,495 @@
-# import smtplib
-# from email.mime.text import MIMEText
-# from email.mime.multipart import MIMEMultipart
-# from email.mime.base import MIMEBase
-# from email import encoders
-# import os
-# from dotenv import load_dotenv
-
-# load_dotenv()
-
-# class EmailService:
-#     def __init__(self):
-#         self.smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
-#         self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
-#         self.smtp_user = os.getenv("SMTP_USER")
-#         self.smtp_password = os.getenv("SMTP_PASSWORD")
-#         self.smtp_from = os.getenv("SMTP_FROM")
-#         self.smtp_from_name = os.getenv("SMTP_FROM_NAME", "Tally Connector")
-#         self.app_url = os.getenv("APP_URL", "http://localhost:8000")
-#         self.frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-
-#     def send_email(self, to_email: str, subject: str, html_content: str):
-#         """Send email using SMTP"""
-#         try:
-#             # Create message
-#             message = MIMEMultipart("alternative")
-#             message["Subject"] = subject
-#             message["From"] = f"{self.smtp_from_name} <{self.smtp_from}>"
-#             message["To"] = to_email
-
-#             # Add HTML content
-#             html_part = MIMEText(html_content, "html")
-#             message.attach(html_part)
-
-#             # Send email
-#             with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-#                 server.starttls()
-#                 server.login(self.smtp_user, self.smtp_password)
-#                 server.send_message(message)
-
-#             print(f"✅ Email sent successfully to {to_email}")
-#             return True
-
-#         except Exception as e:
-#             print(f"❌ Email sending failed: {str(e)}")
-#             return False
-
-#     def send_verification_email(self, to_email: str, verification_token: str, user_name: str):
-#         """Send email verification link"""
-#         verification_link = f"{self.app_url}/api/auth/verify-email?token={verification_token}"
-        
-#         html_content = f"""
-#         <!DOCTYPE html>
-#         <html>
-#         <head>
-#             <style>
-#                 body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-#                 .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-#                 .header {{ background-color: #4CAF50; color: white; padding: 20px; text-align: center; }}
-#                 .content {{ padding: 20px; background-color: #f9f9f9; }}
-#                 .button {{ 
-#                     display: inline-block; 
-#                     padding: 12px 30px; 
-#                     background-color: #4CAF50; 
-#                     color: white; 
-#                     text-decoration: none; 
-#                     border-radius: 5px;
-#                     margin: 20px 0;
-#                 }}
-#                 .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; }}
-#             </style>
-#         </head>
-#         <body>
-#             <div class="container">
-#                 <div class="header">
-#                     <h1>Welcome to Tally Connector!</h1>
-#                 </div>
-#                 <div class="content">
-#                     <p>Hi {user_name},</p>
-#                     <p>Thank you for signing up! Please verify your email address by clicking the button below:</p>
-#                     <center>
-#                         <a href="{verification_link}" class="button">Verify Email</a>
-#                     </center>
-#                     <p>Or copy and paste this link in your browser:</p>
-#                     <p style="word-break: break-all; color: #666;">{verification_link}</p>
-#                     <p>This link will expire in 24 hours.</p>
-#                     <p>If you didn't create this account, please ignore this email.</p>
-#                 </div>
-#                 <div class="footer">
-#                     <p>&copy; 2024 Tally Connector. All rights reserved.</p>
-#                 </div>
-#             </div>
-#         </body>
-#         </html>
-#         """
-        
-#         return self.send_email(to_email, "Verify Your Email - Tally Connector", html_content)
-
-#     def send_otp_email(self, to_email: str, otp: str, user_name: str):
-#         """Send OTP for verification"""
-#         html_content = f"""
-#         <!DOCTYPE html>
-#         <html>
-#         <head>
-#             <style>
-#                 body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-#                 .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-#                 .header {{ background-color: #2196F3; color: white; padding: 20px; text-align: center; }}
-#                 .content {{ padding: 20px; background-color: #f9f9f9; }}
-#                 .otp-code {{ 
-#                     font-size: 32px; 
-#                     font-weight: bold; 
-#                     color: #2196F3; 
-#                     text-align: center;
-#                     padding: 20px;
-#                     background-color: #e3f2fd;
-#                     border-radius: 8px;
-#                     letter-spacing: 5px;
-#                     margin: 20px 0;
-#                 }}
-#                 .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; }}
-#             </style>
-#         </head>
-#         <body>
-#             <div class="container">
-#                 <div class="header">
-#                     <h1>Your Verification Code</h1>
-#                 </div>
-#                 <div class="content">
-#                     <p>Hi {user_name},</p>
-#                     <p>Your verification code is:</p>
-#                     <div class="otp-code">{otp}</div>
-#                     <p>This code will expire in 10 minutes.</p>
-#                     <p>If you didn't request this code, please ignore this email.</p>
-#                 </div>
-#                 <div class="footer">
-#                     <p>&copy; 2024 Tally Connector. All rights reserved.</p>
-#                 </div>
-#             </div>
-#         </body>
-#         </html>
-#         """
-        
-#         return self.send_email(to_email, f"Your Verification Code: {otp}", html_content)
+import asyncio
+import contextlib
+import gzip
+import logging
+import re
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import os
+import threading
+import aiosmtplib
+import httpx
+import orjson
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from dotenv import load_dotenv
 
-#     def send_password_reset_email(self, to_email: str, reset_token: str, user_name: str):
-#         """Send password reset link"""
-#         reset_link = f"{self.frontend_url}/reset-password?token={reset_token}"
-        
-#         html_content = f"""
-#         <!DOCTYPE html>
-#         <html>
-#         <head>
-#             <style>
-#                 body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-#                 .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-#                 .header {{ background-color: #FF5722; color: white; padding: 20px; text-align: center; }}
-#                 .content {{ padding: 20px; background-color: #f9f9f9; }}
-#                 .button {{ 
-#                     display: inline-block; 
-#                     padding: 12px 30px; 
-#                     background-color: #FF5722; 
-#                     color: white; 
-#                     text-decoration: none; 
-#                     border-radius: 5px;
-#                     margin: 20px 0;
-#                 }}
-#                 .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; }}
-#             </style>
-#         </head>
-#         <body>
-#             <div class="container">
-#                 <div class="header">
-#                     <h1>Reset Your Password</h1>
-#                 </div>
-#                 <div class="content">
-#                     <p>Hi {user_name},</p>
-#                     <p>We received a request to reset your password. Click the button below to create a new password:</p>
-#                     <center>
-#                         <a href="{reset_link}" class="button">Reset Password</a>
-#                     </center>
-#                     <p>Or copy and paste this link in your browser:</p>
-#                     <p style="word-break: break-all; color: #666;">{reset_link}</p>
-#                     <p>This link will expire in 1 hour.</p>
-#                     <p>If you didn't request this, please ignore this email and your password will remain unchanged.</p>
-#                 </div>
-#                 <div class="footer">
-#                     <p>&copy; 2024 Tally Connector. All rights reserved.</p>
-#                 </div>
-#             </div>
-#         </body>
-#         </html>
-#         """
-        
-#         return self.send_email(to_email, "Reset Your Password - Tally Connector", html_content)
+# Values already in the environment win; .env only fills in the rest
+load_dotenv()
 
-# # Create global instance
-# email_service = EmailService()
+logger = logging.getLogger("email_service")
 
+# Rejects addresses Resend would bounce with a 4xx, without the round trip
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+\Z")
 
-import resend
-import os
-from dotenv import load_dotenv
+# Resend accepts at most 100 messages per batch request
+RESEND_BATCH_LIMIT = 100
 
-load_dotenv()
+# Emails the background sender posts concurrently per wake-up
+EMAIL_WORKER_BATCH = 32
+
+RESEND_API_URL = os.getenv("RESEND_API_URL", "https://api.resend.com")
+RESEND_TIMEOUT = float(os.getenv("RESEND_TIMEOUT", "10"))
+
+# Recycle the keep-alive connection after this many requests
+RESEND_SESSION_MAX_REQUESTS = 10_000
+
+# Resend does not document gzip request bodies, so compression is opt-in
+RESEND_GZIP = os.getenv("RESEND_GZIP", "false").lower() in ("1", "true", "yes")
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_GZIP_JSON_HEADERS = {**_JSON_HEADERS, "Content-Encoding": "gzip"}
+
+def _encode_body(params) -> tuple[bytes, dict]:
+    """Serialize a Resend request body; orjson is several times faster than json"""
+    body = orjson.dumps(params)
+    if RESEND_GZIP:
+        return gzip.compress(body, compresslevel=1), _GZIP_JSON_HEADERS
+    return body, _JSON_HEADERS
+
+class _ResendTransport:
+    """Stands in for the requests module inside the Resend SDK
+
+    The SDK calls requests.request() directly, which opens a new TCP + TLS
+    connection per email; this routes it through one keep-alive session.
+    """
+
+    def __init__(self):
+        import requests
+        self.HTTPError = requests.HTTPError
+        self._lock = threading.Lock()
+        self._requests_sent = 0
+        self._session = self._new_session()
+        # Requests running on each session; a retired session is closed once
+        # its count drops to zero
+        self._in_flight = {self._session: 0}
+
+    @staticmethod
+    def _new_session():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16, pool_block=False))
+        return session
+
+    def request(self, method, url, json=None, headers=None, **kwargs):
+        if json is not None:
+            kwargs["data"], body_headers = _encode_body(json)
+            headers = {**(headers or {}), **body_headers}
+        kwargs.setdefault("timeout", RESEND_TIMEOUT)
+        retired = None
+        with self._lock:
+            if self._requests_sent >= RESEND_SESSION_MAX_REQUESTS:
+                old = self._session
+                self._session = self._new_session()
+                self._in_flight[self._session] = 0
+                self._requests_sent = 0
+                if self._in_flight[old] == 0:
+                    del self._in_flight[old]
+                    retired = old
+            self._requests_sent += 1
+            session = self._session
+            self._in_flight[session] += 1
+        if retired is not None:
+            retired.close()
+        try:
+            return session.request(method, url, headers=headers, **kwargs)
+        finally:
+            self._release(session)
+
+    def _release(self, session):
+        with self._lock:
+            self._in_flight[session] -= 1
+            if self._in_flight[session] or session is self._session:
+                return
+            del self._in_flight[session]
+        session.close()
+
+_resend = None
+_resend_lock = threading.Lock()
+
+def _load_resend(api_key: str):
+    """Import the Resend SDK on first use; the async worker does not need it"""
+    global _resend
+    with _resend_lock:
+        if _resend is None:
+            import resend
+            import resend.request
+            resend.api_key = api_key
+            resend.request.requests = _ResendTransport()
+            _resend = resend
+    return _resend
+
+# SMTP fallback, used only when Resend is unreachable or failing server-side
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_MAX_MESSAGES = 10_000
+SMTP_KEEPALIVE_INTERVAL = 30
+
+class _SmtpPool:
+    """Bounded pool of authenticated aiosmtplib connections
+
+    Idle connections are kept open with NOOP and reset with RSET between
+    messages; one the server has dropped is replaced on the next send.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, size: int):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self._idle = []
+        self._slots = asyncio.BoundedSemaphore(size)
+        self._keepalive_task = None
+
+    async def _connect(self):
+        conn = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            username=self.user,
+            password=self.password,
+            start_tls=True,
+            timeout=SMTP_TIMEOUT,
+        )
+        await conn.connect()
+        conn.messages_sent = 0
+        return conn
+
+    @staticmethod
+    async def _close(conn):
+        try:
+            await conn.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            conn.close()
+
+    async def get(self):
+        """Check out a live connection, opening one if none is idle"""
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.is_connected:
+                    return conn
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def put(self, conn, reusable: bool = True):
+        """Return a connection; worn-out, broken or surplus ones are closed instead"""
+        try:
+            if (reusable and conn.is_connected and conn.messages_sent < SMTP_MAX_MESSAGES
+                    and len(self._idle) < self.size):
+                self._idle.append(conn)
+            else:
+                await self._close(conn)
+        finally:
+            self._slots.release()
+
+    async def send(self, message):
+        """Send a message, reconnecting once if the server dropped the connection"""
+        conn = await self.get()
+        reusable = False
+        try:
+            try:
+                await conn.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                conn.close()
+                conn = await self._connect()
+                await conn.send_message(message)
+            conn.messages_sent += 1
+            await conn.rset()
+            reusable = True
+        finally:
+            await self.put(conn, reusable)
+
+    def start(self):
+        self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(SMTP_KEEPALIVE_INTERVAL)
+            # Ping one connection at a time, oldest first, under a slot, so
+            # get() still sees the rest and the pool never outgrows its size
+            for _ in range(len(self._idle)):
+                async with self._slots:
+                    if not self._idle:
+                        break
+                    conn = self._idle.pop(0)
+                    try:
+                        await conn.noop()
+                    except (aiosmtplib.SMTPException, OSError):
+                        conn.close()
+                        continue
+                    except asyncio.CancelledError:
+                        conn.close()
+                        raise
+                    self._idle.append(conn)
+
+    async def close(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._keepalive_task
+            self._keepalive_task = None
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._close(conn)
+
+def _resend_degraded(exc: Exception) -> bool:
+    """Whether a Resend failure is worth retrying over SMTP"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if _resend is None:
+        return False
+    import requests
+    from resend.exceptions import ApplicationError
+    return isinstance(exc, (requests.RequestException, ApplicationError))
+
+def _minify(source: str) -> str:
+    """Strip indentation and inter-tag whitespace from template source"""
+    source = re.sub(r">\s+<", "><", source)
+    source = re.sub(r"\s+", " ", source)
+    return source.strip()
+
+class _MinifyingLoader(FileSystemLoader):
+    """Minifies template source before Jinja compiles it"""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return _minify(source), filename, uptodate
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Compiled templates are persisted here so later workers skip lexing and
+# parsing; unset means Jinja's per-user directory under the system temp dir
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR")
+if JINJA_CACHE_DIR:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+
+_env = Environment(
+    # Minified once here, so every send carries the compact markup for free
+    loader=_MinifyingLoader(TEMPLATE_DIR),
+    bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+    autoescape=True,
+    auto_reload=False,
+    cache_size=-1,
+)
+
+# Every send carries a fresh token or OTP, so bodies are not memoized; the
+# compiled templates already stay in the environment's cache
+def _render_verification(user_name: str, verification_link: str) -> str:
+    return _env.get_template("verify.html.j2").render(user_name=user_name, verification_link=verification_link)
+
+def _render_otp(user_name: str, otp: str) -> str:
+    return _env.get_template("otp.html.j2").render(user_name=user_name, otp=otp)
+
+def _render_reset(user_name: str, reset_link: str) -> str:
+    return _env.get_template("reset.html.j2").render(user_name=user_name, reset_link=reset_link)
 
 class EmailService:
     def __init__(self):
-        resend.api_key = os.getenv("RESEND_API_KEY")
+        self._api_key = os.getenv("RESEND_API_KEY")
+        if not self._api_key:
+            # Fail at startup rather than with a 401 on every send
+            raise RuntimeError("RESEND_API_KEY is not set")
         self.smtp_from = os.getenv("SMTP_FROM", "onboarding@resend.dev")
+        self._base_params = {"from": self.smtp_from}
         self.app_url = os.getenv("APP_URL", "http://localhost:8000")
         self.frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+        self._verify_url = (self.app_url + "/api/auth/verify-email?token={}").format
+        self._reset_url = (self.frontend_url + "/reset-password?token={}").format
+        self.smtp_from_name = os.getenv("SMTP_FROM_NAME", "Tally Connector")
+        self._smtp_pool = None
+        if os.getenv("SMTP_USER"):
+            self._smtp_pool = _SmtpPool(
+                host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+                port=int(os.getenv("SMTP_PORT", "587")),
+                user=os.getenv("SMTP_USER"),
+                password=os.getenv("SMTP_PASSWORD"),
+                size=SMTP_POOL_SIZE,
+            )
+        self._loop = None
+        self._queue = None
+        self._client = None
+        self._worker_task = None
+
+    async def start(self):
+        """Start the background sender; call from the app's startup hook"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        # HTTP/2 multiplexes every concurrent send over a single TLS connection
+        self._client = httpx.AsyncClient(
+            http2=True,
+            base_url=RESEND_API_URL,
+            headers={"Authorization": f"Bearer {self._api_key}"},
+            timeout=RESEND_TIMEOUT,
+        )
+        self._worker_task = asyncio.create_task(self._worker())
+        if self._smtp_pool is not None:
+            self._smtp_pool.start()
+
+    async def stop(self):
+        """Flush queued emails and stop the background sender"""
+        if self._worker_task is None:
+            return
+        # Let pending call_soon_threadsafe puts land before joining
+        await asyncio.sleep(0)
+        await self._queue.join()
+        self._worker_task.cancel()
+        try:
+            await self._worker_task
+        except asyncio.CancelledError:
+            pass
+        self._worker_task = None
+        await self._client.aclose()
+        if self._smtp_pool is not None:
+            await self._smtp_pool.close()
 
     def send_email(self, to_email: str, subject: str, html_content: str):
+        """Queue an email for the background sender
+
+        Safe to call from any thread. Sends synchronously when the
+        background sender is not running (e.g. in scripts).
+        """
+        if not _EMAIL_RE.match(to_email):
+            logger.warning("email not sent, invalid recipient", extra={"to": to_email})
+            return False
+
+        params = {**self._base_params, "to": [to_email], "subject": subject, "html": html_content}
+
+        if self._worker_task is None:
+            return self._send_now(params)
+
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, params)
+        return True
+
+    def _send_now(self, params: dict):
         """Send email using Resend"""
         try:
-            params = {
-                "from": self.smtp_from,
-                "to": [to_email],
-                "subject": subject,
-                "html": html_content,
-            }
-            
-            email = resend.Emails.send(params)
-            print(f"✅ Email sent successfully to {to_email}")
-            print(f"Email ID: {email}")
+            email = _load_resend(self._api_key).Emails.send(params)
+            logger.info("email sent", extra={"to": params["to"][0], "id": email})
+            return True
+
+        except Exception as e:
+            if self._smtp_pool is not None and _resend_degraded(e):
+                logger.warning("Resend unavailable, falling back to SMTP: %s", e, extra={"to": params["to"][0]})
+                return self._send_smtp_now(params["to"][0], params["subject"], params["html"])
+            logger.exception("email send failed", extra={"to": params["to"][0]})
+            return False
+
+    def _smtp_message(self, to_email: str, subject: str, html_content: str):
+        message = MIMEMultipart("alternative")
+        message["Subject"] = subject
+        message["From"] = f"{self.smtp_from_name} <{self.smtp_from}>"
+        message["To"] = to_email
+        message.attach(MIMEText(html_content, "html"))
+        return message
+
+    async def send_email_smtp(self, to_email: str, subject: str, html_content: str):
+        """Send email over a pooled SMTP connection"""
+        try:
+            await self._smtp_pool.send(self._smtp_message(to_email, subject, html_content))
+            logger.info("email sent over SMTP", extra={"to": to_email})
             return True
+        except Exception:
+            logger.exception("SMTP email send failed", extra={"to": to_email})
+            return False
+
+    def _send_smtp_now(self, to_email: str, subject: str, html_content: str):
+        """Send email over a one-off SMTP connection, for callers with no event loop"""
+        pool = self._smtp_pool
+        try:
+            asyncio.run(aiosmtplib.send(
+                self._smtp_message(to_email, subject, html_content),
+                hostname=pool.host,
+                port=pool.port,
+                username=pool.user,
+                password=pool.password,
+                start_tls=True,
+                timeout=SMTP_TIMEOUT,
+            ))
+            logger.info("email sent over SMTP", extra={"to": to_email})
+            return True
+        except Exception:
+            logger.exception("SMTP email send failed", extra={"to": to_email})
+            return False
+
+    async def _post(self, params: dict):
+        body, headers = _encode_body(params)
+        response = await self._client.post("/emails", content=body, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def _worker(self):
+        """Drain the queue, sending up to EMAIL_WORKER_BATCH emails concurrently"""
+        while True:
+            group = [await self._queue.get()]
+            while len(group) < EMAIL_WORKER_BATCH and not self._queue.empty():
+                group.append(self._queue.get_nowait())
+
+            await asyncio.gather(*(self._deliver(params) for params in group), return_exceptions=True)
+            for _ in group:
+                self._queue.task_done()
 
+    async def _deliver(self, params: dict):
+        try:
+            email = await self._post(params)
         except Exception as e:
-            print(f"❌ Email sending failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            if self._smtp_pool is not None and _resend_degraded(e):
+                logger.warning("Resend unavailable, falling back to SMTP: %s", e, extra={"to": params["to"][0]})
+                await self.send_email_smtp(params["to"][0], params["subject"], params["html"])
+            else:
+                logger.error("email send failed", exc_info=e, extra={"to": params["to"][0]})
+            return
+        logger.info("email sent", extra={"to": params["to"][0], "id": email})
+
+    def send_batch(self, messages: list[dict]):
+        """Send several emails using one Resend batch request per 100 messages
+
+        Each message is a dict with "to", "subject" and "html" keys.
+        """
+        try:
+            payload = [
+                {**self._base_params, "to": [message["to"]], "subject": message["subject"], "html": message["html"]}
+                for message in messages
+                if _EMAIL_RE.match(message["to"])
+            ]
+            if len(payload) < len(messages):
+                logger.warning("emails skipped, invalid recipient", extra={"count": len(messages) - len(payload)})
+
+            resend = _load_resend(self._api_key)
+            for start in range(0, len(payload), RESEND_BATCH_LIMIT):
+                chunk = payload[start:start + RESEND_BATCH_LIMIT]
+                emails = resend.Batch.send(chunk)
+                logger.info("email batch sent", extra={"count": len(chunk), "ids": emails})
+            return True
+
+        except Exception:
+            logger.exception("email batch send failed")
             return False
 
     def send_verification_email(self, to_email: str, verification_token: str, user_name: str):
         """Send email verification link"""
-        verification_link = f"{self.app_url}/api/auth/verify-email?token={verification_token}"
+        verification_link = self._verify_url(verification_token)
         
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #4CAF50; color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ padding: 30px; background-color: #f9f9f9; }}
-                .button {{ 
-                    display: inline-block; 
-                    padding: 15px 30px; 
-                    background-color: #4CAF50; 
-                    color: white !important; 
-                    text-decoration: none; 
-                    border-radius: 5px;
-                    margin: 20px 0;
-                    font-weight: bold;
-                }}
-                .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; background-color: #f0f0f0; border-radius: 0 0 10px 10px; }}
-                .code-box {{ background: #e8f5e9; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Welcome to Tally Connector!</h1>
-                </div>
-                <div class="content">
-                    <p>Hi <strong>{user_name}</strong>,</p>
-                    <p>Thank you for signing up with Tally Connector! Please verify your email address to get started.</p>
-                    <center>
-                        <a href="{verification_link}" class="button">Verify Email Address</a>
-                    </center>
-                    <p>Or copy and paste this link in your browser:</p>
-                    <div class="code-box">
-                        <code style="word-break: break-all; color: #2e7d32;">{verification_link}</code>
-                    </div>
-                    <p style="margin-top: 20px;">This link will expire in 24 hours.</p>
-                    <p style="color: #666; font-size: 14px;">If you didn't create this account, please ignore this email.</p>
-                </div>
-                <div class="footer">
-                    <p>&copy; 2025 Tally Connector. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        html_content = _render_verification(user_name, verification_link)
         
         return self.send_email(to_email, "Verify Your Email - Tally Connector", html_content)
 
     def send_otp_email(self, to_email: str, otp: str, user_name: str):
         """Send OTP for verification"""
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #2196F3; color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ padding: 30px; background-color: #f9f9f9; }}
-                .otp-code {{ 
-                    font-size: 36px; 
-                    font-weight: bold; 
-                    color: #2196F3; 
-                    text-align: center;
-                    padding: 25px;
-                    background-color: #e3f2fd;
-                    border-radius: 10px;
-                    letter-spacing: 8px;
-                    margin: 25px 0;
-                    border: 2px solid #2196F3;
-                }}
-                .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; background-color: #f0f0f0; border-radius: 0 0 10px 10px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Your Verification Code</h1>
-                </div>
-                <div class="content">
-                    <p>Hi <strong>{user_name}</strong>,</p>
-                    <p>Your verification code for Tally Connector is:</p>
-                    <div class="otp-code">{otp}</div>
-                    <p style="text-align: center; color: #666; margin-top: 20px;">Enter this code in the app to verify your email</p>
-                    <p style="color: #f44336; text-align: center; margin-top: 15px;"><strong>This code will expire in 10 minutes.</strong></p>
-                    <p style="color: #666; font-size: 14px; margin-top: 20px;">If you didn't request this code, please ignore this email.</p>
-                </div>
-                <div class="footer">
-                    <p>&copy; 2025 Tally Connector. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        html_content = _render_otp(user_name, otp)
         
         return self.send_email(to_email, f"Your Verification Code: {otp}", html_content)
 
     def send_password_reset_email(self, to_email: str, reset_token: str, user_name: str):
         """Send password reset link"""
-        reset_link = f"{self.frontend_url}/reset-password?token={reset_token}"
+        reset_link = self._reset_url(reset_token)
         
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #FF5722; color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ padding: 30px; background-color: #f9f9f9; }}
-                .button {{ 
-                    display: inline-block; 
-                    padding: 15px 30px; 
-                    background-color: #FF5722; 
-                    color: white !important; 
-                    text-decoration: none; 
-                    border-radius: 5px;
-                    margin: 20px 0;
-                    font-weight: bold;
-                }}
-                .footer {{ padding: 20px; text-align: center; font-size: 12px; color: #666; background-color: #f0f0f0; border-radius: 0 0 10px 10px; }}
-                .code-box {{ background: #ffebee; padding: 15px; border-radius: 5px; margin: 15px 0; border-left: 4px solid #FF5722; }}
-                .warning {{ background: #fff3cd; padding: 15px; border-radius: 5px; border-left: 4px solid #ffc107; margin: 15px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🔐 Reset Your Password</h1>
-                </div>
-                <div class="content">
-                    <p>Hi <strong>{user_name}</strong>,</p>
-                    <p>We received a request to reset your password for your Tally Connector account.</p>
-                    <p>Click the button below to create a new password:</p>
-                    <center>
-                        <a href="{reset_link}" class="button">Reset Password</a>
-                    </center>
-                    <p>Or copy and paste this link in your browser:</p>
-                    <div class="code-box">
-                        <code style="word-break: break-all; color: #d32f2f;">{reset_link}</code>
-                    </div>
-                    <div class="warning">
-                        <strong>⏰ This link will expire in 1 hour.</strong>
-                    </div>
-                    <p style="color: #666; font-size: 14px; margin-top: 20px;">If you didn't request a password reset, please ignore this email and your password will remain unchanged.</p>
-                    <p style="color: #666; font-size: 14px;">For security reasons, never share this link with anyone.</p>
-                </div>
-                <div class="footer">
-                    <p>&copy; 2025 Tally Connector. All rights reserved.</p>
-                    <p style="margin-top: 5px;">Questions? Contact us at support@tallyconnector.com</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        html_content = _render_reset(user_name, reset_link)
         
         return self.send_email(to_email, "Reset Your Password - Tally Connector", html_content)
 
@@ -1,54 +1,195 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Depends, Header, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
-from datetime import datetime, timedelta
-import psycopg
+from datetime import datetime
+from psycopg.conninfo import make_conninfo
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 import secrets
 import jwt
-from typing import Optional
+from typing import Optional, Union
 import os
 from dotenv import load_dotenv
 import bcrypt
-from email_service import email_service
-import random
-import string
-# Load environment variables
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import base64
+import orjson
+import threading
+import time
+from cachetools import TLRUCache
+import logging
+# Load environment variables before email_service reads its settings
 load_dotenv()
+from email_service import email_service
+
+# Set LOG_LEVEL=WARNING in production to silence per-email info logs
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("tally.auth")
 
-app = FastAPI(title="Tally Connector API")
+app = FastAPI(title="Tally Connector API", default_response_class=ORJSONResponse)
 
 # CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class CORSAsgi:
+    """Pure-ASGI CORS: works on raw header lists, no Request/Response objects"""
+
+    ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+    def __init__(self, app, allow_origins=("*",), max_age=600):
+        self.app = app
+        self.allow_all = "*" in allow_origins
+        self.allow_origins = {origin.encode("latin-1") for origin in allow_origins}
+        self.max_age = str(max_age).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            return await self.app(scope, receive, send)
+        allowed = self.allow_all or origin in self.allow_origins
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            return await self._preflight(send, origin if allowed else None, request_headers)
+        if not allowed:
+            return await self.app(scope, receive, send)
+
+        cors_headers = self._origin_headers(origin)
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    def _origin_headers(self, origin):
+        # A wildcard never carries credentials, so any site may call the API
+        # but never with the browser's cookies or auth; only origins named in
+        # the allow-list are echoed back with credentials
+        if self.allow_all:
+            return [(b"access-control-allow-origin", b"*")]
+        return [
+            (b"access-control-allow-origin", origin),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+
+    async def _preflight(self, send, origin, request_headers):
+        if origin is None:
+            body = b"Disallowed CORS origin"
+            await send({"type": "http.response.start", "status": 400, "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = [
+            *self._origin_headers(origin),
+            (b"access-control-allow-methods", self.ALLOW_METHODS),
+            (b"access-control-max-age", self.max_age),
+        ]
+        if request_headers is not None:
+            headers.append((b"access-control-allow-headers", request_headers))
+        await send({"type": "http.response.start", "status": 204, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+# Comma-separated list of allowed origins; "*" allows any origin without
+# credentials (the API authenticates with bearer headers, not cookies)
+CORS_ALLOW_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()]
+
+app.add_middleware(CORSAsgi, allow_origins=CORS_ALLOW_ORIGINS)
 
 # JWT Config
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_HOURS = int(os.getenv("ACCESS_TOKEN_EXPIRE_HOURS", "24"))
 
+# HS256 tokens always carry the same header, so it is serialized once and the
+# key bytes are prepared once; other algorithms go through PyJWT
+KEY_BYTES = SECRET_KEY.encode()
+HEADER_B64 = base64.urlsafe_b64encode(orjson.dumps({"alg": "HS256", "typ": "JWT"})).rstrip(b"=")
+
 # Password hashing functions using bcrypt directly
-def hash_password(password: str) -> str:
+# bcrypt releases the GIL, so hashing on worker threads runs in parallel
+# while the event loop keeps serving other requests
+# BCRYPT_ROUNDS sets the work factor (each step doubles the cost); 12 is the
+# default and 10 the lowest accepted
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+if BCRYPT_ROUNDS < BCRYPT_MIN_ROUNDS:
+    logger.warning("BCRYPT_ROUNDS=%d is below the minimum, using %d", BCRYPT_ROUNDS, BCRYPT_MIN_ROUNDS)
+    BCRYPT_ROUNDS = BCRYPT_MIN_ROUNDS
+_bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+
+# bcrypt only uses the first 72 bytes of a password, so longer input is cut
+# up front; its hashes are plain ASCII
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+async def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
-    password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
+    password_bytes = password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS, prefix=b"2b")
+    loop = asyncio.get_running_loop()
+    hashed = await loop.run_in_executor(_bcrypt_pool, bcrypt.hashpw, password_bytes, salt)
+    return hashed.decode('ascii')
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: Union[str, bytes]) -> bool:
     """Verify a password against a bcrypt hash"""
-    password_bytes = plain_password.encode('utf-8')
-    hashed_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    password_bytes = plain_password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+    hashed_bytes = hashed_password if isinstance(hashed_password, bytes) else hashed_password.encode('ascii')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_pool, bcrypt.checkpw, password_bytes, hashed_bytes)
+
+# Checked against on unknown emails so a login miss costs the same bcrypt
+# work as a wrong password and response time doesn't reveal which emails exist
+DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=BCRYPT_ROUNDS, prefix=b"2b")).decode('ascii')
+
+# Random tokens are cut from a shared os.urandom buffer, so one syscall
+# covers many tokens; a forked child drops the inherited buffer so it never
+# hands out the same bytes as its parent
+_RND_POOL = bytearray()
+_RND_LOCK = threading.Lock()
+os.register_at_fork(after_in_child=_RND_POOL.clear)
+
+def _rand_bytes(n: int) -> bytes:
+    with _RND_LOCK:
+        if len(_RND_POOL) < n:
+            _RND_POOL.extend(os.urandom(4096))
+        out = bytes(_RND_POOL[:n])
+        del _RND_POOL[:n]
+    return out
 
-# Database connection with Neon SSL support
-def get_db():
-    conn = psycopg.connect(
+def token_urlsafe32() -> str:
+    """Same output as secrets.token_urlsafe(32)"""
+    return base64.urlsafe_b64encode(_rand_bytes(32)).rstrip(b"=").decode("ascii")
+
+# Database connection pool with Neon SSL support
+async def _configure_conn(conn):
+    # Prepare every statement on its first run (psycopg prepares once a query
+    # has run prepare_threshold times before); the same few auth queries
+    # repeat on every request, so Postgres skips parse/plan from the second run
+    conn.prepare_threshold = 0
+    # Expiry times are sent as epoch seconds through to_timestamp() and stored
+    # as naive UTC, so pin the session time zone; this round trip also makes
+    # sure a new connection is fully established before use
+    await conn.execute("SET TIME ZONE 'UTC'")
+
+pool = AsyncConnectionPool(
+    conninfo=make_conninfo(
         host=os.getenv("DB_HOST", "localhost"),
         port=os.getenv("DB_PORT", "5432"),
         dbname=os.getenv("DB_NAME", "neondb"),
@@ -56,12 +197,95 @@ def get_db():
         password=os.getenv("DB_PASSWORD", "your_password"),
         sslmode=os.getenv("DB_SSLMODE", "prefer"),
         connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "30")),
-        row_factory=dict_row
-    )
-    try:
+    ),
+    min_size=int(os.getenv("DB_POOL_MIN_SIZE", "5")),
+    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "20")),
+    # Reads run without an implicit transaction, so read-only and rejected
+    # requests never pay for a COMMIT/ROLLBACK; writes use conn.transaction()
+    kwargs={"row_factory": dict_row, "autocommit": True},
+    configure=_configure_conn,
+    check=AsyncConnectionPool.check_connection,
+    open=False,
+)
+
+async def get_db():
+    # Pipeline mode sends BEGIN, writes and COMMIT without waiting for each
+    # reply; a fetch still syncs, so reads return their rows as before
+    async with pool.connection() as conn, conn.pipeline():
         yield conn
+
+# Expired sessions are dropped in the background rather than on logout
+SESSION_REAP_INTERVAL = int(os.getenv("SESSION_REAP_INTERVAL", "300"))
+_reaper_task = None
+
+async def _reaper():
+    while True:
+        await asyncio.sleep(SESSION_REAP_INTERVAL)
+        try:
+            async with pool.connection() as conn:
+                await conn.execute("DELETE FROM user_sessions WHERE expires_at < NOW()")
+        except Exception:
+            logger.exception("Expired session cleanup failed")
+
+# Login records last_login here instead of writing it inline; repeat logins
+# by one user collapse to the latest, and each flush is a single UPDATE
+LAST_LOGIN_FLUSH_INTERVAL = float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", "2"))
+_pending_last_logins = {}
+_last_login_task = None
+
+async def _flush_last_logins():
+    if not _pending_last_logins:
+        return
+    batch = _pending_last_logins.copy()
+    _pending_last_logins.clear()
+    written = False
+    try:
+        # GREATEST keeps another worker's newer login from being overwritten
+        async with pool.connection() as conn:
+            await conn.execute("""
+                UPDATE users SET last_login = GREATEST(users.last_login, v.login_at)
+                FROM unnest(%s::bigint[], %s::timestamp[]) AS v(user_id, login_at)
+                WHERE users.user_id = v.user_id
+            """, (list(batch), list(batch.values())))
+        written = True
     finally:
-        conn.close()
+        # On any failure, cancellation included, keep the batch for the next
+        # flush unless a newer login replaced it
+        if not written:
+            for user_id, login_at in batch.items():
+                _pending_last_logins.setdefault(user_id, login_at)
+
+async def _last_login_writer():
+    while True:
+        await asyncio.sleep(LAST_LOGIN_FLUSH_INTERVAL)
+        try:
+            await _flush_last_logins()
+        except Exception:
+            logger.exception("last_login flush failed")
+
+@app.on_event("startup")
+async def startup():
+    global _reaper_task, _last_login_task
+    await pool.open()
+    await email_service.start()
+    _reaper_task = asyncio.create_task(_reaper())
+    _last_login_task = asyncio.create_task(_last_login_writer())
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in (_reaper_task, _last_login_task):
+        if task is not None:
+            task.cancel()
+            # Wait for a flush in progress to hand its batch back
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    try:
+        await _flush_last_logins()
+    except Exception:
+        logger.exception("last_login flush failed")
+    await email_service.stop()
+    await pool.close()
+    _bcrypt_pool.shutdown(wait=False)
 
 # Models
 class UserSignup(BaseModel):
@@ -87,27 +311,81 @@ class TokenResponse(BaseModel):
     user: dict
 
 # Helper functions for JWT
-def create_access_token(user_id: int, email: str) -> str:
-    expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
+def _sign_hs256(signing_input: bytes) -> bytes:
+    digest = hmac.new(KEY_BYTES, signing_input, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=")
+
+def _encode_hs256(claims: dict) -> str:
+    payload_b64 = base64.urlsafe_b64encode(orjson.dumps(claims)).rstrip(b"=")
+    signing_input = HEADER_B64 + b"." + payload_b64
+    return (signing_input + b"." + _sign_hs256(signing_input)).decode()
+
+def _decode_hs256(token: str) -> dict:
+    """Verify an HS256 token, raising the same errors as jwt.decode"""
+    try:
+        signing_input, _, signature = token.encode("ascii").rpartition(b".")
+        header_b64, _, payload_b64 = signing_input.partition(b".")
+        if header_b64 != HEADER_B64 or not hmac.compare_digest(signature, _sign_hs256(signing_input)):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        payload = orjson.loads(base64.urlsafe_b64decode(payload_b64 + b"=" * (-len(payload_b64) % 4)))
+    except ValueError as e:
+        raise jwt.DecodeError("Invalid token") from e
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload")
+    exp = payload.get("exp")
+    if exp is not None:
+        if not isinstance(exp, (int, float)):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be an integer")
+        if exp <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+    return payload
+
+# Profile fields carried in the token so /me can answer without a DB read
+TOKEN_PROFILE_FIELDS = ('email', 'full_name', 'phone', 'is_verified', 'is_active', 'created_at', 'last_login')
+
+def create_access_token(user: dict, session_token: str, expires_at: int) -> str:
+    # jti ties the token to its user_sessions row so logout can end just that session
     to_encode = {
-        "user_id": user_id,
-        "email": email,
-        "exp": expire
+        "user_id": user['user_id'],
+        "jti": session_token,
+        "exp": expires_at
     }
+    for field in TOKEN_PROFILE_FIELDS:
+        value = user.get(field)
+        to_encode[field] = value.isoformat() if isinstance(value, datetime) else value
+    if ALGORITHM == "HS256":
+        return _encode_hs256(to_encode)
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Verified token payloads, keyed by the token's SHA-256 and evicted at its exp.
+# Only tokens that passed signature verification are ever inserted.
+_token_cache = TLRUCache(maxsize=10_000, ttu=lambda _key, payload, _now: payload.get("exp", 0), timer=time.time)
+_token_cache_lock = threading.Lock()
+
 def verify_token(token: str) -> dict:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    key = hashlib.sha256(token.encode()).digest()
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    if payload is not None:
         return payload
+
+    try:
+        if ALGORITHM == "HS256":
+            payload = _decode_hs256(token)
+        else:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    with _token_cache_lock:
+        _token_cache[key] = payload
+    return payload
+
 # Routes
 @app.get("/")
-def root():
+async def root():
     return {
         "message": "Tally Connector API is running!",
         "version": "1.0.0",
@@ -115,57 +393,52 @@ def root():
     }
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat()
     }
 
 @app.post("/api/auth/signup", response_model=TokenResponse)
-def signup(user: UserSignup, conn=Depends(get_db)):
+async def signup(user: UserSignup, background_tasks: BackgroundTasks, conn=Depends(get_db)):
     try:
-        cursor = conn.cursor()
-        
-        # Check if email exists
-        cursor.execute("SELECT user_id FROM users WHERE email = %s", (user.email,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Email already registered")
-        
         # Hash password
-        password_hash = hash_password(user.password)
+        password_hash = await hash_password(user.password)
         
-        # Generate verification token
-        verification_token = secrets.token_urlsafe(32)
+        # Generate verification and session tokens
+        verification_token = token_urlsafe32()
+        session_token = token_urlsafe32()
+        expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_HOURS * 3600
         
-        # Insert user
-        cursor.execute("""
-            INSERT INTO users (full_name, email, password_hash, phone, email_verification_token)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING user_id, email, full_name, phone, is_verified, created_at
-        """, (user.full_name, user.email, password_hash, user.phone, verification_token))
-        
-        new_user = cursor.fetchone()
-        conn.commit()
+        # Insert user and create their session in one round trip; the unique
+        # index on email turns a duplicate signup into an empty result
+        async with conn.transaction():
+            new_user = await (await conn.execute("""
+                WITH new_user AS (
+                    INSERT INTO users (full_name, email, password_hash, phone, email_verification_token)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING user_id, email, full_name, phone, is_verified, created_at
+                ), new_session AS (
+                    INSERT INTO user_sessions (user_id, session_token, device_type, expires_at)
+                    SELECT user_id, %s, %s, to_timestamp(%s) FROM new_user
+                )
+                SELECT * FROM new_user
+            """, (user.full_name, user.email, password_hash, user.phone, verification_token,
+                  session_token, 'mobile', expires_at))).fetchone()
+            if not new_user:
+                raise HTTPException(status_code=400, detail="Email already registered")
         
         # Send verification email
-        email_service.send_verification_email(
+        background_tasks.add_task(
+            email_service.send_verification_email,
             new_user['email'],
             verification_token,
             new_user['full_name']
         )
         
         # Generate token
-        access_token = create_access_token(new_user['user_id'], new_user['email'])
-        
-        # Create session
-        session_token = secrets.token_urlsafe(32)
-        expires_at = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-        
-        cursor.execute("""
-            INSERT INTO user_sessions (user_id, session_token, device_type, expires_at)
-            VALUES (%s, %s, %s, %s)
-        """, (new_user['user_id'], session_token, 'mobile', expires_at))
-        conn.commit()
+        access_token = create_access_token({**new_user, 'is_active': True}, session_token, expires_at)
         
         return {
             "access_token": access_token,
@@ -174,68 +447,49 @@ def signup(user: UserSignup, conn=Depends(get_db)):
         }
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"❌ Signup Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
+    except Exception:
+        logger.exception("Signup failed")
+        raise HTTPException(status_code=500, detail="Signup failed")
     
 @app.post("/api/auth/login", response_model=TokenResponse)
-def login(credentials: UserLogin, conn=Depends(get_db)):
-    cursor = conn.cursor()
-    
+async def login(credentials: UserLogin, conn=Depends(get_db)):
     # Get user
-    cursor.execute("""
+    user = await (await conn.execute("""
         SELECT user_id, email, password_hash, full_name, phone, 
                is_active, is_verified, created_at, last_login
         FROM users 
         WHERE email = %s
-    """, (credentials.email,))
-    
-    user = cursor.fetchone()
+    """, (credentials.email,))).fetchone()
     
     if not user:
+        await verify_password(credentials.password, DUMMY_HASH)
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Verify password
-    if not verify_password(credentials.password, user['password_hash']):
+    if not await verify_password(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     if not user['is_active']:
         raise HTTPException(status_code=403, detail="Account is deactivated")
     
-    # Update last login
-    cursor.execute("""
-        UPDATE users SET last_login = NOW() WHERE user_id = %s
-    """, (user['user_id'],))
-    conn.commit()
-    
-    # Generate token
-    access_token = create_access_token(user['user_id'], user['email'])
-    
-    # Create session
-    session_token = secrets.token_urlsafe(32)
-    expires_at = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    
-    cursor.execute("""
-        INSERT INTO user_sessions (user_id, session_token, device_type, expires_at)
-        VALUES (%s, %s, %s, %s)
-    """, (user['user_id'], session_token, 'mobile', expires_at))
-    conn.commit()
-    
-    # Remove password_hash from response
-    user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-    
-    # Ensure all required fields are present
-    user_response = {
-        'user_id': user_data['user_id'],
-        'email': user_data['email'],
-        'full_name': user_data['full_name'],
-        'phone': user_data.get('phone'),  # Can be null
-        'is_verified': user_data.get('is_verified', False),
-        'created_at': user_data['created_at'].isoformat() if user_data.get('created_at') else None,
-        'last_login': user_data['last_login'].isoformat() if user_data.get('last_login') else None,
-    }
+    # Generate session and token
+    # last_login is written as the same value the token carries, so /me
+    # answers identically from the token and from the database
+    login_at = datetime.utcnow()
+    session_token = token_urlsafe32()
+    expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_HOURS * 3600
+    access_token = create_access_token({**user, 'last_login': login_at}, session_token, expires_at)
+    
+    # Create session; last_login is written by the background flush
+    async with conn.transaction():
+        await conn.execute("""
+            INSERT INTO user_sessions (user_id, session_token, device_type, expires_at)
+            VALUES (%s, %s, %s, to_timestamp(%s))
+        """, (user['user_id'], session_token, 'mobile', expires_at))
+    _pending_last_logins[user['user_id']] = login_at
+    
+    # Datetimes are serialized by the orjson response class
+    user_response = {k: v for k, v in user.items() if k not in ('password_hash', 'is_active')}
     
     return {
         "access_token": access_token,
@@ -243,28 +497,26 @@ def login(credentials: UserLogin, conn=Depends(get_db)):
         "user": user_response
     }
 @app.post("/api/auth/forgot-password")
-def forgot_password(data: ForgotPassword, conn=Depends(get_db)):
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT user_id, email, full_name FROM users WHERE email = %s", (data.email,))
-    user = cursor.fetchone()
+async def forgot_password(data: ForgotPassword, background_tasks: BackgroundTasks, conn=Depends(get_db)):
+    user = await (await conn.execute("SELECT user_id, email, full_name FROM users WHERE email = %s", (data.email,))).fetchone()
     
     if not user:
         # Don't reveal if email exists
         return {"message": "If email exists, password reset link has been sent"}
     
-    reset_token = secrets.token_urlsafe(32)
-    reset_expires = datetime.utcnow() + timedelta(hours=1)
+    reset_token = token_urlsafe32()
+    reset_expires = int(time.time()) + 3600
     
-    cursor.execute("""
-        UPDATE users 
-        SET password_reset_token = %s, password_reset_expires = %s
-        WHERE user_id = %s
-    """, (reset_token, reset_expires, user['user_id']))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET password_reset_token = %s, password_reset_expires = to_timestamp(%s)
+            WHERE user_id = %s
+        """, (reset_token, reset_expires, user['user_id']))
     
     # Send password reset email
-    email_service.send_password_reset_email(
+    background_tasks.add_task(
+        email_service.send_password_reset_email,
         user['email'],
         reset_token,
         user['full_name']
@@ -273,16 +525,12 @@ def forgot_password(data: ForgotPassword, conn=Depends(get_db)):
     return {"message": "Password reset link sent to your email"}
 
 @app.post("/api/auth/reset-password")
-def reset_password(data: ResetPassword, conn=Depends(get_db)):
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+async def reset_password(data: ResetPassword, conn=Depends(get_db)):
+    user = await (await conn.execute("""
         SELECT user_id, password_reset_expires 
         FROM users 
         WHERE password_reset_token = %s
-    """, (data.token,))
-    
-    user = cursor.fetchone()
+    """, (data.token,))).fetchone()
     
     if not user:
         raise HTTPException(status_code=400, detail="Invalid reset token")
@@ -290,36 +538,45 @@ def reset_password(data: ResetPassword, conn=Depends(get_db)):
     if user['password_reset_expires'] < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Reset token has expired")
     
-    new_password_hash = hash_password(data.new_password)
+    new_password_hash = await hash_password(data.new_password)
     
-    cursor.execute("""
-        UPDATE users 
-        SET password_hash = %s, 
-            password_reset_token = NULL,
-            password_reset_expires = NULL,
-            updated_at = NOW()
-        WHERE user_id = %s
-    """, (new_password_hash, user['user_id']))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET password_hash = %s, 
+                password_reset_token = NULL,
+                password_reset_expires = NULL,
+                updated_at = NOW()
+            WHERE user_id = %s
+        """, (new_password_hash, user['user_id']))
     
     return {"message": "Password reset successful"}
 
 @app.get("/api/auth/me")
-def get_current_user(authorization: str = Header(None), conn=Depends(get_db)):
+async def get_current_user(authorization: str = Header(None), refresh: bool = False):
+    """Return the profile embedded in the token; refresh=true re-reads it from the database"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     token = authorization.replace("Bearer ", "")
     payload = verify_token(token)
     
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT user_id, email, full_name, phone, is_verified, created_at, last_login
-        FROM users 
-        WHERE user_id = %s AND is_active = TRUE
-    """, (payload['user_id'],))
-    
-    user = cursor.fetchone()
+    # Tokens issued before profiles were embedded always go to the database,
+    # and so do unverified users: verify-email and verify-otp flip is_verified
+    # after the token was issued, and clients poll /me to see it (a verified
+    # user never goes back to unverified, so a True claim can't be stale)
+    if not refresh and 'is_active' in payload and payload['is_verified']:
+        if not payload['is_active']:
+            raise HTTPException(status_code=404, detail="User not found")
+        return {"user_id": payload['user_id'],
+                **{field: payload[field] for field in TOKEN_PROFILE_FIELDS if field != 'is_active'}}
+    
+    async with pool.connection() as conn:
+        user = await (await conn.execute("""
+            SELECT user_id, email, full_name, phone, is_verified, created_at, last_login
+            FROM users 
+            WHERE user_id = %s AND is_active = TRUE
+        """, (payload['user_id'],))).fetchone()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -327,50 +584,51 @@ def get_current_user(authorization: str = Header(None), conn=Depends(get_db)):
     return dict(user)
 
 @app.post("/api/auth/logout")
-def logout(authorization: str = Header(None), conn=Depends(get_db)):
+async def logout(authorization: str = Header(None), conn=Depends(get_db)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     token = authorization.replace("Bearer ", "")
     payload = verify_token(token)
     
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM user_sessions WHERE user_id = %s
-    """, (payload['user_id'],))
-    conn.commit()
+    async with conn.transaction():
+        if 'jti' in payload:
+            await conn.execute("""
+                DELETE FROM user_sessions WHERE user_id = %s AND session_token = %s
+            """, (payload['user_id'], payload['jti']))
+        else:
+            # Tokens issued before sessions were tied to a jti
+            await conn.execute("""
+                DELETE FROM user_sessions WHERE user_id = %s
+            """, (payload['user_id'],))
     
     return {"message": "Logged out successfully"}
 def generate_otp(length=6):
     """Generate numeric OTP"""
-    return ''.join(random.choices(string.digits, k=length))
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
 
 # Email Verification Endpoint
 @app.get("/api/auth/verify-email")
-def verify_email(token: str, conn=Depends(get_db)):
+async def verify_email(token: str, conn=Depends(get_db)):
     """Verify email using token"""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    user = await (await conn.execute("""
         SELECT user_id, email, full_name 
         FROM users 
         WHERE email_verification_token = %s
-    """, (token,))
-    
-    user = cursor.fetchone()
+    """, (token,))).fetchone()
     
     if not user:
         raise HTTPException(status_code=400, detail="Invalid or expired verification token")
     
     # Update user as verified
-    cursor.execute("""
-        UPDATE users 
-        SET is_verified = TRUE, 
-            email_verification_token = NULL,
-            updated_at = NOW()
-        WHERE user_id = %s
-    """, (user['user_id'],))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET is_verified = TRUE, 
+                email_verification_token = NULL,
+                updated_at = NOW()
+            WHERE user_id = %s
+        """, (user['user_id'],))
     
     return {
         "message": "Email verified successfully!",
@@ -379,17 +637,13 @@ def verify_email(token: str, conn=Depends(get_db)):
 
 # Resend Verification Email
 @app.post("/api/auth/resend-verification")
-def resend_verification(email: str, conn=Depends(get_db)):
+async def resend_verification(email: str, background_tasks: BackgroundTasks, conn=Depends(get_db)):
     """Resend verification email"""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    user = await (await conn.execute("""
         SELECT user_id, email, full_name, is_verified 
         FROM users 
         WHERE email = %s
-    """, (email,))
-    
-    user = cursor.fetchone()
+    """, (email,))).fetchone()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -398,17 +652,18 @@ def resend_verification(email: str, conn=Depends(get_db)):
         return {"message": "Email already verified"}
     
     # Generate new verification token
-    verification_token = secrets.token_urlsafe(32)
+    verification_token = token_urlsafe32()
     
-    cursor.execute("""
-        UPDATE users 
-        SET email_verification_token = %s
-        WHERE user_id = %s
-    """, (verification_token, user['user_id']))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET email_verification_token = %s
+            WHERE user_id = %s
+        """, (verification_token, user['user_id']))
     
     # Send verification email
-    email_service.send_verification_email(
+    background_tasks.add_task(
+        email_service.send_verification_email,
         user['email'],
         verification_token,
         user['full_name']
@@ -418,36 +673,33 @@ def resend_verification(email: str, conn=Depends(get_db)):
 
 # Send OTP
 @app.post("/api/auth/send-otp")
-def send_otp(email: str, conn=Depends(get_db)):
+async def send_otp(email: str, background_tasks: BackgroundTasks, conn=Depends(get_db)):
     """Send OTP to email"""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    user = await (await conn.execute("""
         SELECT user_id, email, full_name 
         FROM users 
         WHERE email = %s
-    """, (email,))
-    
-    user = cursor.fetchone()
+    """, (email,))).fetchone()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Generate OTP
     otp = generate_otp(6)
-    otp_expires = datetime.utcnow() + timedelta(minutes=10)
+    otp_expires = int(time.time()) + 600
     
     # Store OTP in database (you'll need to add otp column to users table)
-    cursor.execute("""
-        UPDATE users 
-        SET email_verification_token = %s,
-            password_reset_expires = %s
-        WHERE user_id = %s
-    """, (otp, otp_expires, user['user_id']))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET email_verification_token = %s,
+                password_reset_expires = to_timestamp(%s)
+            WHERE user_id = %s
+        """, (otp, otp_expires, user['user_id']))
     
     # Send OTP email
-    email_service.send_otp_email(
+    background_tasks.add_task(
+        email_service.send_otp_email,
         user['email'],
         otp,
         user['full_name']
@@ -457,17 +709,13 @@ def send_otp(email: str, conn=Depends(get_db)):
 
 # Verify OTP
 @app.post("/api/auth/verify-otp")
-def verify_otp(email: str, otp: str, conn=Depends(get_db)):
+async def verify_otp(email: str, otp: str, conn=Depends(get_db)):
     """Verify OTP"""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+    user = await (await conn.execute("""
         SELECT user_id, email_verification_token, password_reset_expires 
         FROM users 
         WHERE email = %s
-    """, (email,))
-    
-    user = cursor.fetchone()
+    """, (email,))).fetchone()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -480,14 +728,14 @@ def verify_otp(email: str, otp: str, conn=Depends(get_db)):
         raise HTTPException(status_code=400, detail="OTP has expired")
     
     # Clear OTP after successful verification
-    cursor.execute("""
-        UPDATE users 
-        SET email_verification_token = NULL,
-            password_reset_expires = NULL,
-            is_verified = TRUE
-        WHERE user_id = %s
-    """, (user['user_id']))
-    conn.commit()
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE users 
+            SET email_verification_token = NULL,
+                password_reset_expires = NULL,
+                is_verified = TRUE
+            WHERE user_id = %s
+        """, (user['user_id'],))
     
     return {"message": "OTP verified successfully"}
 if __name__ == "__main__":
@@ -0,0 +1,6 @@
+-- Unique index backing signup's INSERT ... ON CONFLICT (email) DO NOTHING.
+-- It also serves the email lookups in login, forgot-password and send-otp.
+-- CONCURRENTLY cannot run inside a transaction block, so run this file on
+-- its own (psql -f), not wrapped in BEGIN/COMMIT. It fails if duplicate
+-- emails already exist; remove those first.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email ON users (email);
@@ -0,0 +1,4 @@
+-- Logout deletes a single session by (user_id, session_token), and the
+-- background reaper deletes by expires_at. Run outside a transaction block.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sessions_user_token ON user_sessions (user_id, session_token);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sessions_expires ON user_sessions (expires_at);
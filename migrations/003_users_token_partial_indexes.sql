@@ -0,0 +1,5 @@
+-- reset-password and verify-email look users up by their pending token.
+-- Most rows have no token, so the indexes only cover rows where one is set.
+-- Run outside a transaction block (CONCURRENTLY).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_reset_token ON users (password_reset_token) WHERE password_reset_token IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_verification_token ON users (email_verification_token) WHERE email_verification_token IS NOT NULL;